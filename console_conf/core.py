@@ -39,7 +39,9 @@ class ConsoleConf(TuiApplication):
 
     def __init__(self, opts):
         super().__init__(opts)
-        self.prober = Prober(opts.machine_config, self.debug_flags)
+        self.prober = Prober(
+            opts.machine_config, self.debug_flags,
+            cache_dir=self.root if opts.dry_run else None)
 
 
 class RecoveryChooser(TuiApplication):
@@ -65,7 +67,9 @@ class RecoveryChooser(TuiApplication):
         )
 
         super().__init__(opts)
-        self.prober = Prober(opts.machine_config, self.debug_flags)
+        self.prober = Prober(
+            opts.machine_config, self.debug_flags,
+            cache_dir=self.root if opts.dry_run else None)
 
     def respond(self, choice):
         """Produce a response to the parent process"""
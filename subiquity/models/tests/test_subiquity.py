@@ -253,11 +253,11 @@ class TestSubiquityModel(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(expected_error, str(ctx.exception))
 
     @mock.patch('subiquity.models.subiquity.lsb_release')
-    @mock.patch('subiquitycore.file_util.datetime.datetime')
+    @mock.patch('subiquitycore.file_util.time')
     def test_cloud_init_files_emits_datasource_config_and_clean_script(
-        self, datetime, lsb_release
+        self, time, lsb_release
     ):
-        datetime.utcnow.return_value = "2004-03-05 ..."
+        time.strftime.return_value = "2004-03-05 ..."
         main_user = IdentityData(
             username='mainuser',
             crypted_password='sample_pass',
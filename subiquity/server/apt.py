@@ -16,6 +16,7 @@
 import asyncio
 import contextlib
 import enum
+import functools
 import io
 import logging
 import os
@@ -40,6 +41,7 @@ from subiquity.server.mounter import (
     DryRunMounter,
     Mounter,
     Mountpoint,
+    MountSpec,
     OverlayCleanupError,
     OverlayMountpoint,
     )
@@ -69,6 +71,13 @@ def get_index_targets() -> List[str]:
     return [key for key in targets if key.count("::") == 3]
 
 
+@functools.lru_cache(maxsize=None)
+def lsb_codename(dry_run: bool) -> str:
+    """ Return the codename of the release, which does not change while we
+    are running. """
+    return lsb_release(dry_run=dry_run)['codename']
+
+
 class AptConfigurer:
     # We configure apt during installation so that installs from the pool on
     # the cdrom are preferred during installation but remove this again in the
@@ -131,6 +140,8 @@ class AptConfigurer:
 
         config_location = os.path.join(
             self.app.root, 'var/log/installer/subiquity-curtin-apt.conf')
+        # Write the config synchronously rather than in a thread: a thread
+        # cannot be cancelled, so a restart of the task could race with it.
         generate_config_yaml(config_location, self.apt_config(final))
         self.app.note_data_for_apport("CurtinAptConfig", config_location)
 
@@ -208,37 +219,50 @@ class AptConfigurer:
         if returncode != 0:
             raise AptConfigCheckError
 
+    async def setup_install_tree(self) -> OverlayMountpoint:
+        # Create the cdrom mountpoint in the upper layer so that the overlay
+        # and the bind-mount of /cdrom can be set up in a single command.
+        spec, install_tree = await self.mounter.prepare_overlay(
+            [self.configured_tree])
+        os.mkdir(os.path.join(install_tree.upperdir, 'cdrom'))
+        await self.mounter.mount_all([
+            spec,
+            MountSpec(
+                device='/cdrom', mountpoint=install_tree.p('cdrom'),
+                options='bind'),
+            ])
+        return install_tree
+
     async def configure_for_install(self, context):
         assert self.configured_tree is not None
 
-        self.install_tree = await self.mounter.setup_overlay(
-            [self.configured_tree])
-
-        os.mkdir(self.install_tree.p('cdrom'))
-        await self.mounter.mount(
-            '/cdrom', self.install_tree.p('cdrom'), options='bind')
+        self.install_tree = await self.setup_install_tree()
+        root = self.install_tree.p()
+        etc_apt = self.install_tree.p('etc/apt')
+        sources_list = f'{etc_apt}/sources.list'
 
+        # All the file changes to the install tree are done here, before the
+        # apt-get update below. They cannot happen earlier as the install tree
+        # can only be mounted once apt-config has configured the tree below.
         if self.app.base_model.network.has_network:
             os.rename(
-                self.install_tree.p('etc/apt/sources.list'),
-                self.install_tree.p('etc/apt/sources.list.d/original.list'))
+                sources_list, f'{etc_apt}/sources.list.d/original.list')
         else:
-            proxy_path = self.install_tree.p(
-                'etc/apt/apt.conf.d/90curtin-aptproxy')
-            if os.path.exists(proxy_path):
+            proxy_path = f'{etc_apt}/apt.conf.d/90curtin-aptproxy'
+            with contextlib.suppress(FileNotFoundError):
                 os.unlink(proxy_path)
 
-        codename = lsb_release(dry_run=self.app.opts.dry_run)['codename']
+        codename = lsb_codename(self.app.opts.dry_run)
 
         write_file(
-            self.install_tree.p('etc/apt/sources.list'),
+            sources_list,
             f'deb [check-date=no] file:///cdrom {codename} main restricted\n')
 
         await run_curtin_command(
-            self.app, context, "in-target", "-t", self.install_tree.p(),
+            self.app, context, "in-target", "-t", root,
             "--", "apt-get", "update", private_mounts=True)
 
-        return self.install_tree.p()
+        return root
 
     @contextlib.asynccontextmanager
     async def overlay(self):
@@ -277,6 +301,10 @@ class AptConfigurer:
         await _restore_dir('etc/apt')
 
         if self.app.base_model.network.has_network:
+            # The package lists in the target were fetched with the cdrom
+            # pool as the primary source, which configure_for_install always
+            # adds, so they never match the restored sources and have to be
+            # refreshed.
             await run_curtin_command(
                 self.app, context, "in-target", "-t", target_mnt.p(),
                 "--", "apt-get", "update", private_mounts=True)
@@ -335,7 +363,7 @@ class DryRunAptConfigurer(AptConfigurer):
         """ Pretend that the execution of the apt-get update command results in
         a failure. """
         url = self.app.base_model.mirror.primary_staged.uri
-        release = lsb_release(dry_run=True)["codename"]
+        release = lsb_codename(True)
         host = url.split("/")[2]
 
         output.write(f"""\
@@ -371,7 +399,7 @@ E: Some index files failed to download. They have been ignored,
         """ Pretend that the execution of the apt-get update command results in
         a success. """
         url = self.app.base_model.mirror.primary_staged.uri
-        release = lsb_release(dry_run=True)["codename"]
+        release = lsb_codename(True)
 
         output.write(f"""\
 Get:1 {url} {release} InRelease [267 kB]
@@ -13,15 +13,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import functools
 import logging
 import os
+import re
+import shlex
 import shutil
+import subprocess
 import tempfile
-from typing import List, Optional, Union
+from typing import List, Optional, Set, Tuple, Union
 
 import attr
 
+from subiquitycore.async_helpers import run_in_thread
 from subiquitycore.utils import arun_command
 
 log = logging.getLogger('subiquity.server.mounter')
@@ -37,14 +42,17 @@ class TmpFileSet:
         self._tdirs.append(d)
         return d
 
-    def cleanup(self):
-        for d in self._tdirs[:]:
+    async def cleanup(self):
+        async def _rmtree(d):
             try:
-                shutil.rmtree(d)
+                await run_in_thread(shutil.rmtree, d)
                 self._tdirs.remove(d)
             except OSError as ose:
                 log.warning(f'failed to rmtree {d}: {ose}')
 
+        # The upper layers can contain many files, remove them in parallel.
+        await asyncio.gather(*[_rmtree(d) for d in self._tdirs[:]])
+
 
 class OverlayCleanupError(Exception):
     """ Exception to raise when an overlay could not be cleaned up. """
@@ -68,6 +76,14 @@ class Mountpoint(_MountBase):
     mountpoint: str
 
 
+@attr.s(auto_attribs=True, kw_only=True)
+class MountSpec:
+    device: str
+    mountpoint: str
+    options: Optional[str] = None
+    type: Optional[str] = None
+
+
 @attr.s(auto_attribs=True, kw_only=True)
 class OverlayMountpoint(_MountBase):
     # The first element in lowers will be the bottom layer and the last element
@@ -108,6 +124,16 @@ def _lowerdir_for_lst(lst):
     return ':'.join(reversed([lowerdir_for(item) for item in lst]))
 
 
+def _current_mountpoints() -> Set[str]:
+    with open('/proc/self/mountinfo') as fp:
+        return {
+            # Whitespace and backslashes in mountpoints are escaped as octal.
+            re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)),
+                   line.split()[4])
+            for line in fp
+            }
+
+
 class Mounter:
 
     def __init__(self, app):
@@ -115,18 +141,43 @@ class Mounter:
         self.tmpfiles = TmpFileSet()
         self._mounts: List[Mountpoint] = []
 
-    async def mount(self, device, mountpoint, options=None, type=None):
+    def _mount_cmd(self, spec: MountSpec) -> List[str]:
         opts = []
-        if options is not None:
-            opts.extend(['-o', options])
-        if type is not None:
-            opts.extend(['-t', type])
-        await self.app.command_runner.run(
-            ['mount'] + opts + [device, mountpoint], private_mounts=False)
-        m = Mountpoint(mountpoint=mountpoint)
-        self._mounts.append(m)
+        if spec.options is not None:
+            opts.extend(['-o', spec.options])
+        if spec.type is not None:
+            opts.extend(['-t', spec.type])
+        return ['mount'] + opts + [spec.device, spec.mountpoint]
+
+    async def mount(self, device, mountpoint, options=None, type=None):
+        [m] = await self.mount_all([MountSpec(
+            device=device, mountpoint=mountpoint, options=options, type=type)])
         return m
 
+    async def mount_all(self, specs: List[MountSpec]) -> List[Mountpoint]:
+        """Perform the mounts described by specs, in order, using a single
+        command invocation."""
+        cmds = [self._mount_cmd(spec) for spec in specs]
+        if len(cmds) == 1:
+            cmd = cmds[0]
+        else:
+            cmd = ['sh', '-ec', '\n'.join(shlex.join(c) for c in cmds)]
+        try:
+            await self.app.command_runner.run(cmd, private_mounts=False)
+        except subprocess.CalledProcessError:
+            if len(specs) > 1:
+                # The script stops at the first mount that fails. Keep track
+                # of the ones that succeeded so that cleanup() unmounts them.
+                mounted = _current_mountpoints()
+                for spec in specs:
+                    if os.path.realpath(spec.mountpoint) not in mounted:
+                        break
+                    self._mounts.append(Mountpoint(mountpoint=spec.mountpoint))
+            raise
+        mounts = [Mountpoint(mountpoint=spec.mountpoint) for spec in specs]
+        self._mounts.extend(mounts)
+        return mounts
+
     async def unmount(self, mountpoint: Mountpoint, remove=True):
         if remove:
             self._mounts.remove(mountpoint)
@@ -134,29 +185,41 @@ class Mounter:
                 ['umount', mountpoint.mountpoint],
                 private_mounts=False)
 
-    async def setup_overlay(self, lowers: List[Lower]) -> OverlayMountpoint:
+    async def prepare_overlay(self, lowers: List[Lower]) \
+            -> Tuple[MountSpec, OverlayMountpoint]:
+        """Create the directories for an overlay over lowers and return the
+        spec to mount it along with the resulting (not yet mounted)
+        overlay."""
         tdir = self.tmpfiles.tdir()
         target = f'{tdir}/mount'
         lowerdir = lowerdir_for(lowers)
         upperdir = f'{tdir}/upper'
         workdir = f'{tdir}/work'
-        for d in target, workdir, upperdir:
-            os.mkdir(d)
+        os.mkdir(target)
+        os.mkdir(workdir)
+        os.mkdir(upperdir)
 
         options = f'lowerdir={lowerdir},upperdir={upperdir},workdir={workdir}'
 
-        mount = await self.mount(
-            'overlay', target, options=options, type='overlay')
-
-        return OverlayMountpoint(
+        spec = MountSpec(
+            device='overlay', mountpoint=target, options=options,
+            type='overlay')
+        return spec, OverlayMountpoint(
             lowers=lowers,
-            mountpoint=mount.p(),
+            mountpoint=target,
             upperdir=upperdir)
 
+    async def setup_overlay(self, lowers: List[Lower]) -> OverlayMountpoint:
+        spec, overlay = await self.prepare_overlay(lowers)
+        await self.mount_all([spec])
+        return overlay
+
     async def cleanup(self):
-        for m in reversed(self._mounts):
-            await self.unmount(m, remove=False)
-        self.tmpfiles.cleanup()
+        if self._mounts:
+            mountpoints = [m.mountpoint for m in reversed(self._mounts)]
+            await self.app.command_runner.run(
+                    ['umount'] + mountpoints, private_mounts=False)
+        await self.tmpfiles.cleanup()
 
     async def bind_mount_tree(self, src, dst):
         """bind-mount files and directories from src that are not already
@@ -178,7 +241,8 @@ class Mounter:
 
 class DryRunMounter(Mounter):
 
-    async def setup_overlay(self, lowers: List[Lower]) -> OverlayMountpoint:
+    async def prepare_overlay(self, lowers: List[Lower]) \
+            -> Tuple[MountSpec, OverlayMountpoint]:
         # XXX This implementation expects that:
         # - on first invocation, the lowers list contains a single string
         # element.
@@ -197,7 +261,17 @@ class DryRunMounter(Mounter):
         await arun_command([
             'cp', '-aT', f'{source}/etc/apt', f'{target}/etc/apt',
             ], check=True)
-        return OverlayMountpoint(
+        spec = MountSpec(device='overlay', mountpoint=target, type='overlay')
+        # The "overlay" is a plain copy, so it is its own upper layer.
+        return spec, OverlayMountpoint(
             lowers=[source],
             mountpoint=target,
-            upperdir=None)
+            upperdir=target)
+
+    async def mount_all(self, specs: List[MountSpec]) -> List[Mountpoint]:
+        # Overlays are plain directories in dry-run mode, there is nothing to
+        # mount for them.
+        specs = [spec for spec in specs if spec.type != 'overlay']
+        if not specs:
+            return []
+        return await super().mount_all(specs)
@@ -305,7 +305,9 @@ class SubiquityServer(Application):
         if opts.machine_config == NOPROBERARG:
             self.prober = None
         else:
-            self.prober = Prober(opts.machine_config, self.debug_flags)
+            self.prober = Prober(
+                opts.machine_config, self.debug_flags,
+                cache_dir=self.root if opts.dry_run else None)
         self.kernel_cmdline = opts.kernel_cmdline
         if opts.snaps_from_examples:
             connection = get_fake_connection(
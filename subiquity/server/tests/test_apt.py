@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import io
+import os
 import subprocess
 from unittest.mock import Mock, patch, AsyncMock
 
@@ -27,6 +28,7 @@ from subiquity.server.apt import (
     OverlayMountpoint,
 )
 from subiquity.server.dryrun import DRConfig
+from subiquity.server.mounter import DryRunMounter, Mounter
 from subiquity.models.mirror import MirrorModel
 from subiquity.models.proxy import ProxyModel
 from subiquity.models.subiquity import DebconfSelectionsModel
@@ -134,6 +136,126 @@ class TestAptConfigurer(SubiTestCase):
                 await self.configurer.run_apt_config_check(output)
 
 
+def populate_etc_apt(root, *, proxy=True):
+    """ Create a minimal etc/apt tree, as left by curtin apt-config. """
+    os.makedirs(f'{root}/etc/apt/sources.list.d')
+    os.makedirs(f'{root}/etc/apt/apt.conf.d')
+    with open(f'{root}/etc/apt/sources.list', 'w') as fp:
+        fp.write('deb http://mirror focal main\n')
+    if proxy:
+        with open(f'{root}/etc/apt/apt.conf.d/90curtin-aptproxy', 'w') as fp:
+            fp.write('Acquire::http::Proxy "http://proxy";\n')
+
+
+class TestConfigureForInstall(SubiTestCase):
+    def setUp(self):
+        self.model = Mock()
+        self.app = make_app(self.model)
+        patcher = patch("subiquity.server.apt.run_curtin_command",
+                        new_callable=AsyncMock)
+        self.run_curtin = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("subiquity.server.apt.lsb_codename",
+                        return_value="focal")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_install_tree(self, root, has_network):
+        with open(f'{root}/etc/apt/sources.list') as fp:
+            self.assertEqual(
+                'deb [check-date=no] file:///cdrom focal main restricted\n',
+                fp.read())
+        original = f'{root}/etc/apt/sources.list.d/original.list'
+        proxy = f'{root}/etc/apt/apt.conf.d/90curtin-aptproxy'
+        if has_network:
+            with open(original) as fp:
+                self.assertEqual('deb http://mirror focal main\n', fp.read())
+            self.assertTrue(os.path.exists(proxy))
+        else:
+            self.assertFalse(os.path.exists(original))
+            self.assertFalse(os.path.exists(proxy))
+        self.run_curtin.assert_called_once_with(
+            self.app, None, "in-target", "-t", root,
+            "--", "apt-get", "update", private_mounts=True)
+
+    async def configure_real(self, has_network, proxy=True):
+        self.model.network.has_network = has_network
+        mounter = Mounter(self.app)
+        self.addAsyncCleanup(mounter.tmpfiles.cleanup)
+        configurer = AptConfigurer(self.app, mounter, '/source')
+        configurer.configured_tree = OverlayMountpoint(
+            lowers=["/source"],
+            upperdir="/configured/upper",
+            mountpoint="/configured/mount",
+            )
+
+        async def fake_run(cmd, **kwargs):
+            # Pretend that the overlay got mounted: make the content of the
+            # lower layers show up in the mountpoint.
+            overlay_target = cmd[2].split('\n')[0].split()[-1]
+            populate_etc_apt(overlay_target, proxy=proxy)
+
+        with patch.object(self.app, "command_runner",
+                          create=True, new_callable=AsyncMock) as runner:
+            runner.run.side_effect = fake_run
+            root = await configurer.configure_for_install(None)
+
+        tdir = os.path.dirname(configurer.install_tree.upperdir)
+        self.assertEqual(f'{tdir}/mount', root)
+        # The cdrom mountpoint is created in the upper layer, so that the
+        # overlay and the bind-mount can be done in one go.
+        self.assertTrue(os.path.isdir(f'{tdir}/upper/cdrom'))
+        runner.run.assert_called_once_with([
+            "sh", "-ec",
+            "mount -o lowerdir=/configured/upper:/source,"
+            f"upperdir={tdir}/upper,workdir={tdir}/work "
+            f"-t overlay overlay {tdir}/mount\n"
+            f"mount -o bind /cdrom {tdir}/mount/cdrom",
+            ], private_mounts=False)
+        self.assertEqual(2, len(mounter._mounts))
+        self.assert_install_tree(root, has_network)
+
+    async def test_configure_for_install_network(self):
+        await self.configure_real(has_network=True)
+
+    async def test_configure_for_install_no_network(self):
+        await self.configure_real(has_network=False)
+
+    async def test_configure_for_install_no_network_no_proxy(self):
+        await self.configure_real(has_network=False, proxy=False)
+
+    async def configure_dry_run(self, has_network):
+        self.model.network.has_network = has_network
+        source = self.tmp_dir()
+        populate_etc_apt(source)
+        mounter = DryRunMounter(self.app)
+        self.addAsyncCleanup(mounter.tmpfiles.cleanup)
+        configurer = DryRunAptConfigurer(self.app, mounter, source)
+        with patch.object(self.app, "command_runner",
+                          create=True, new_callable=AsyncMock) as runner:
+            configurer.configured_tree = await mounter.setup_overlay(
+                [source])
+            root = await configurer.configure_for_install(None)
+
+        # The dry-run overlay is a plain directory, which is its own upper
+        # layer, and only the bind-mount is (pretend) run.
+        self.assertEqual(configurer.install_tree.upperdir, root)
+        self.assertTrue(os.path.isdir(f'{root}/cdrom'))
+        runner.run.assert_called_once_with(
+            ["mount", "-o", "bind", "/cdrom", f"{root}/cdrom"],
+            private_mounts=False)
+        self.assert_install_tree(root, has_network)
+        # The source is left alone.
+        with open(f'{source}/etc/apt/sources.list') as fp:
+            self.assertEqual('deb http://mirror focal main\n', fp.read())
+
+    async def test_configure_for_install_dry_run_network(self):
+        await self.configure_dry_run(has_network=True)
+
+    async def test_configure_for_install_dry_run_no_network(self):
+        await self.configure_dry_run(has_network=False)
+
+
 class TestDRAptConfigurer(SubiTestCase):
     def setUp(self):
         self.model = Mock()
@@ -14,15 +14,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import subprocess
 from unittest.mock import AsyncMock, call, Mock, patch
 
 from subiquitycore.tests import SubiTestCase
 from subiquitycore.tests.mocks import make_app
 from subiquity.server.mounter import (
+    DryRunMounter,
     lowerdir_for,
     Mounter,
     Mountpoint,
+    MountSpec,
     OverlayMountpoint,
+    TmpFileSet,
 )
 
 
@@ -40,6 +44,54 @@ class TestMounter(SubiTestCase):
             m = await mounter.mount("/dev/cdrom", "/target")
             await mounter.unmount(m)
 
+    async def test_mount_all(self):
+        mounter = Mounter(self.app)
+        with patch.object(self.app, "command_runner",
+                          create=True, new_callable=AsyncMock) as runner:
+            mounts = await mounter.mount_all([
+                MountSpec(device="overlay", mountpoint="/a",
+                          options="lowerdir=/x", type="overlay"),
+                MountSpec(device="/cdrom", mountpoint="/a/cdrom",
+                          options="bind"),
+                ])
+        runner.run.assert_called_once_with([
+            "sh", "-ec",
+            "mount -o lowerdir=/x -t overlay overlay /a\n"
+            "mount -o bind /cdrom /a/cdrom",
+            ], private_mounts=False)
+        self.assertEqual(
+            [Mountpoint(mountpoint="/a"), Mountpoint(mountpoint="/a/cdrom")],
+            mounts)
+
+    async def test_mount_all_partial_failure(self):
+        mounter = Mounter(self.app)
+        a = os.path.realpath(self.tmp_dir())
+        specs = [
+            MountSpec(device="overlay", mountpoint=a, type="overlay"),
+            MountSpec(device="/cdrom", mountpoint=f"{a}/cdrom",
+                      options="bind"),
+            ]
+        with patch.object(self.app, "command_runner",
+                          create=True, new_callable=AsyncMock) as runner:
+            runner.run.side_effect = subprocess.CalledProcessError(1, "sh")
+            with patch("subiquity.server.mounter._current_mountpoints",
+                       return_value={"/", a}):
+                with self.assertRaises(subprocess.CalledProcessError):
+                    await mounter.mount_all(specs)
+        # The overlay got mounted before the bind-mount failed.
+        self.assertEqual([Mountpoint(mountpoint=a)], mounter._mounts)
+
+    async def test_cleanup_single_umount(self):
+        mounter = Mounter(self.app)
+        with patch.object(self.app, "command_runner",
+                          create=True, new_callable=AsyncMock) as runner:
+            await mounter.mount("/dev/cdrom", "/target")
+            await mounter.mount("/cdrom", "/target/cdrom", options="bind")
+            runner.run.reset_mock()
+            await mounter.cleanup()
+        runner.run.assert_called_once_with(
+            ["umount", "/target/cdrom", "/target"], private_mounts=False)
+
     async def test_bind_mount_tree(self):
         mounter = Mounter(self.app)
         # bind_mount_tree bind-mounts files and directories from src
@@ -113,6 +165,60 @@ class TestMounter(SubiTestCase):
         mocked.assert_called_once_with(src, dst, options='bind')
 
 
+class TestDryRunMounter(SubiTestCase):
+
+    def setUp(self):
+        self.model = Mock()
+        self.app = make_app(self.model)
+
+    async def test_prepare_overlay(self):
+        mounter = DryRunMounter(self.app)
+        source = self.tmp_dir()
+        os.makedirs(f'{source}/etc/apt')
+        with open(f'{source}/etc/apt/sources.list', 'w') as fp:
+            fp.write('deb http://mirror focal main\n')
+        spec, overlay = await mounter.prepare_overlay([source])
+        self.assertEqual(overlay.mountpoint, overlay.upperdir)
+        self.assertTrue(os.path.exists(overlay.p('etc/apt/sources.list')))
+        await mounter.cleanup()
+
+    async def test_mount_all_skips_overlays(self):
+        mounter = DryRunMounter(self.app)
+        with patch.object(self.app, "command_runner",
+                          create=True, new_callable=AsyncMock) as runner:
+            mounts = await mounter.mount_all([
+                MountSpec(device="overlay", mountpoint="/a", type="overlay"),
+                MountSpec(device="/cdrom", mountpoint="/a/cdrom",
+                          options="bind"),
+                ])
+        runner.run.assert_called_once_with(
+            ["mount", "-o", "bind", "/cdrom", "/a/cdrom"],
+            private_mounts=False)
+        self.assertEqual([Mountpoint(mountpoint="/a/cdrom")], mounts)
+
+
+class TestTmpFileSet(SubiTestCase):
+    async def test_cleanup(self):
+        tmpfiles = TmpFileSet()
+        dirs = [tmpfiles.tdir() for _ in range(3)]
+        for d in dirs:
+            os.mkdir(os.path.join(d, 'upper'))
+        await tmpfiles.cleanup()
+        for d in dirs:
+            self.assertFalse(os.path.exists(d))
+        self.assertEqual([], tmpfiles._tdirs)
+
+    async def test_cleanup_failure(self):
+        tmpfiles = TmpFileSet()
+        d = tmpfiles.tdir()
+        with patch("subiquity.server.mounter.shutil.rmtree",
+                   side_effect=OSError):
+            await tmpfiles.cleanup()
+        self.assertEqual([d], tmpfiles._tdirs)
+        await tmpfiles.cleanup()
+        self.assertEqual([], tmpfiles._tdirs)
+
+
 class TestLowerDirFor(SubiTestCase):
     def test_lowerdir_for_str(self):
         self.assertEqual(
@@ -13,16 +13,33 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
 import contextlib
-import datetime
 import grp
 import logging
 import os
 import shutil
 import tempfile
+import time
 
 import yaml
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
+
+class _ConfigDumper(SafeDumper):
+    """ Safe dumper that also knows how to write OrderedDicts (such as the
+    ones the storage config is built from), preserving their order. """
+
+
+_ConfigDumper.add_representer(
+    OrderedDict,
+    lambda self, data: self.represent_mapping(
+        'tag:yaml.org,2002:map', data.items()))
+
 _DEF_PERMS_FILE = 0o640
 _DEF_GROUP = 'adm'
 
@@ -70,14 +87,14 @@ def write_file(filename, content, **kwargs):
 
 
 def generate_timestamped_header() -> str:
-    now = datetime.datetime.utcnow()
+    now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
     return f'# Autogenerated by Subiquity: {now} UTC\n'
 
 
 def generate_config_yaml(filename, content, **kwargs):
     with open_perms(filename, **kwargs) as tf:
-        tf.write(generate_timestamped_header())
-        tf.write(yaml.dump(content))
+        tf.write(generate_timestamped_header() +
+                 yaml.dump(content, Dumper=_ConfigDumper))
 
 
 def copy_file_if_exists(source: str, target: str):
@@ -13,27 +13,90 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import hashlib
 import logging
+import os
+import pickle
+import stat
+import tempfile
 import time
 import yaml
 
-from probert.network import (
-    StoredDataObserver,
-    UdevObserver,
-    )
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 log = logging.getLogger('subiquitycore.prober')
 
 
+def _load_cached_config(fp, cache_dir):
+    """Load the machine config from fp, using a pickled copy stored in
+    cache_dir when it is still up to date.
+
+    Only use this in dry-run mode: the pickle is trusted as much as
+    cache_dir is."""
+    path = getattr(fp, 'name', None)
+    try:
+        st = os.fstat(fp.fileno())
+    except (AttributeError, OSError, ValueError):
+        st = None
+    if not isinstance(path, str) or st is None or \
+            not stat.S_ISREG(st.st_mode):
+        return yaml.load(fp, Loader=SafeLoader)
+
+    key = (st.st_mtime_ns, st.st_size)
+    digest = hashlib.sha256(os.path.realpath(path).encode()).hexdigest()
+    cache = os.path.join(cache_dir, 'machine-config-cache', digest + '.pickle')
+    try:
+        with open(cache, 'rb') as cfp:
+            if os.fstat(cfp.fileno()).st_uid == os.getuid():
+                cached_key, config = pickle.load(cfp)
+                if cached_key == key:
+                    return config
+    except (OSError, pickle.UnpicklingError, EOFError, TypeError,
+            ValueError):
+        pass
+
+    config = yaml.load(fp, Loader=SafeLoader)
+
+    tf = None
+    try:
+        dirname = os.path.dirname(cache)
+        os.makedirs(dirname, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+                dir=dirname, delete=False, mode='wb') as tf:
+            pickle.dump((key, config), tf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tf.name, cache)
+    except OSError as ose:
+        log.debug('failed to cache machine config in %s: %s', cache, ose)
+        if tf is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(tf.name)
+    return config
+
+
 class Prober():
-    def __init__(self, machine_config, debug_flags):
+    def __init__(self, machine_config, debug_flags, *, cache_dir=None):
+        # The parsed machine config is only cached when cache_dir is given,
+        # which should only be done in dry-run mode.
         self.saved_config = None
         if machine_config:
-            self.saved_config = yaml.safe_load(machine_config)
+            if cache_dir is not None:
+                self.saved_config = _load_cached_config(
+                    machine_config, cache_dir)
+            else:
+                self.saved_config = yaml.load(
+                    machine_config, Loader=SafeLoader)
         self.debug_flags = debug_flags
         log.debug('Prober() init finished, data:{}'.format(self.saved_config))
 
     def probe_network(self, receiver):
+        from probert.network import (
+            StoredDataObserver,
+            UdevObserver,
+            )
         if self.saved_config is not None:
             observer = StoredDataObserver(
                 self.saved_config['network'], receiver)
@@ -49,11 +112,10 @@ class Prober():
             if flag in self.debug_flags:
                 time.sleep(2)
                 1/0
-            r = self.saved_config['storage'].copy()
-            if probe_types is not None and 'defaults' not in probe_types:
-                for k in self.saved_config['storage']:
-                    if k not in probe_types:
-                        r[k] = {}
-            return r
+            storage = self.saved_config['storage']
+            if probe_types is None or 'defaults' in probe_types:
+                return storage.copy()
+            return {k: (v if k in probe_types else {})
+                    for k, v in storage.items()}
         from probert.storage import Storage
         return Storage().probe(probe_types=probe_types)
@@ -13,7 +13,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from subiquitycore.file_util import copy_file_if_exists
+from collections import OrderedDict
+
+import yaml
+
+from subiquitycore.file_util import (
+    copy_file_if_exists,
+    generate_config_yaml,
+    )
 from subiquitycore.tests import SubiTestCase
 
 
@@ -29,3 +36,26 @@ class TestCopy(SubiTestCase):
 
     def test_copied_non_exist_src(self):
         copy_file_if_exists('/does/not/exist', '/ditto')
+
+
+class TestGenerateConfigYaml(SubiTestCase):
+    def test_round_trip(self):
+        content = {'apt': {'preserve_sources_list': False, 'sources': []}}
+        path = self.tmp_path('config.yaml')
+        generate_config_yaml(path, content)
+        with open(path, 'r') as fp:
+            self.assertTrue(fp.readline().startswith(
+                '# Autogenerated by Subiquity: '))
+            self.assertEqual(content, yaml.safe_load(fp))
+
+    def test_ordered_dict(self):
+        content = {'storage': {'config': [
+            OrderedDict(type='disk', id='disk-sda', ptable='gpt'),
+            ]}}
+        path = self.tmp_path('config.yaml')
+        generate_config_yaml(path, content)
+        with open(path, 'r') as fp:
+            fp.readline()
+            body = fp.read()
+        self.assertEqual(content, yaml.safe_load(body))
+        self.assertIn('- type: disk\n    id: disk-sda\n', body)
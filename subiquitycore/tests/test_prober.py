@@ -13,15 +13,98 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
+from unittest import mock
+
 from subiquitycore.tests import SubiTestCase
 
 from subiquitycore.prober import Prober
 
 
 class TestProber(SubiTestCase):
+    def copy_example(self, name='simple.json'):
+        # Work on a copy so that the cache is never written to the tree.
+        path = self.tmp_path(name)
+        shutil.copy(os.path.join('examples', name), path)
+        return path
+
     def test_none_and_defaults_equal(self):
-        with open('examples/simple.json', 'r') as fp:
+        with open(self.copy_example(), 'r') as fp:
             prober = Prober(machine_config=fp, debug_flags=())
         none_storage = prober.get_storage(probe_types=None)
         defaults_storage = prober.get_storage(probe_types={'defaults'})
         self.assertEqual(defaults_storage, none_storage)
+
+    def test_restricted_probe_types(self):
+        with open(self.copy_example(), 'r') as fp:
+            prober = Prober(machine_config=fp, debug_flags=())
+        full = prober.get_storage(probe_types=None)
+        restricted = prober.get_storage(probe_types={'blockdev'})
+        self.assertEqual(set(full), set(restricted))
+        for k, v in restricted.items():
+            if k == 'blockdev':
+                self.assertEqual(full[k], v)
+            else:
+                self.assertEqual({}, v)
+
+    def test_machine_config_cached(self):
+        path = self.copy_example()
+        cache_dir = self.tmp_dir()
+        with open(path, 'r') as fp:
+            first = Prober(
+                machine_config=fp, debug_flags=(), cache_dir=cache_dir)
+        with mock.patch('subiquitycore.prober.yaml.load') as m_load:
+            with open(path, 'r') as fp:
+                second = Prober(
+                    machine_config=fp, debug_flags=(), cache_dir=cache_dir)
+        m_load.assert_not_called()
+        self.assertEqual(first.saved_config, second.saved_config)
+
+    def test_machine_config_cache_location(self):
+        path = self.copy_example()
+        cache_dir = self.tmp_dir()
+        with open(path, 'r') as fp:
+            Prober(machine_config=fp, debug_flags=(), cache_dir=cache_dir)
+        # The source directory is left alone, the cache goes to cache_dir.
+        self.assertEqual(['simple.json'], os.listdir(os.path.dirname(path)))
+        [cached] = os.listdir(os.path.join(cache_dir, 'machine-config-cache'))
+        self.assertTrue(cached.endswith('.pickle'))
+
+    def test_machine_config_cache_keyed_on_path(self):
+        cache_dir = self.tmp_dir()
+        configs = {}
+        for content in 'storage: {a: {}}\n', 'storage: {b: {}}\n':
+            # Same size and, possibly, same mtime: only the path differs.
+            path = self.tmp_path('config.yaml')
+            with open(path, 'w') as fp:
+                fp.write(content)
+            with open(path, 'r') as fp:
+                prober = Prober(
+                    machine_config=fp, debug_flags=(), cache_dir=cache_dir)
+            configs[content] = prober.saved_config
+        self.assertEqual({'storage': {'a': {}}}, configs['storage: {a: {}}\n'])
+        self.assertEqual({'storage': {'b': {}}}, configs['storage: {b: {}}\n'])
+
+    def test_machine_config_cache_stale(self):
+        path = self.tmp_path('config.yaml')
+        cache_dir = self.tmp_dir()
+        with open(path, 'w') as fp:
+            fp.write('storage: {}\n')
+        with open(path, 'r') as fp:
+            Prober(machine_config=fp, debug_flags=(), cache_dir=cache_dir)
+        with open(path, 'w') as fp:
+            fp.write('storage: {blockdev: {}}\n')
+        with open(path, 'r') as fp:
+            prober = Prober(
+                machine_config=fp, debug_flags=(), cache_dir=cache_dir)
+        self.assertEqual({'storage': {'blockdev': {}}}, prober.saved_config)
+
+    def test_machine_config_not_cached_without_cache_dir(self):
+        path = self.copy_example()
+        with mock.patch('subiquitycore.prober.pickle') as m_pickle:
+            with open(path, 'r') as fp:
+                prober = Prober(machine_config=fp, debug_flags=())
+        m_pickle.load.assert_not_called()
+        m_pickle.dump.assert_not_called()
+        self.assertIn('storage', prober.saved_config)
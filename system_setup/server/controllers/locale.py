@@ -23,7 +23,8 @@ class WSLLocaleController(LocaleController):
     def __init__(self, app):
         super().__init__(app)
         if self.app.prefillInfo:
-            welcome = self.app.prefillInfo.get('Welcome', {'lang': None})
+            # The Welcome section may be present but empty.
+            welcome = self.app.prefillInfo.get('Welcome') or {}
             win_lang = welcome.get('lang')
             if win_lang:
                 self.model.selected_language = win_lang
@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from aiohttp import web
+import jsonschema
 
 from system_setup.common.wsl_utils import is_reconfigure
 from subiquity.server.server import SubiquityServer
@@ -23,6 +24,12 @@ from subiquity.models.subiquity import ModelNames
 import logging
 import yaml
 import os
+import re
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 log = logging.getLogger('system_setup.server.server')
 
@@ -41,6 +48,88 @@ POSTINSTALL_MODEL_NAMES = ModelNames(set())
 
 LOCALHOST_ADDR = "127.0.0.1"
 
+# Top-level sections of the prefill file consumed by the controllers.
+PREFILL_KEYS = ("Welcome", "WSLIdentity")
+PREFILL_HEADER_SIZE = 8192
+PREFILL_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'Welcome': {
+            'type': ['object', 'null'],
+            'properties': {
+                'lang': {'type': ['string', 'null']},
+                },
+            },
+        'WSLIdentity': {
+            'type': ['object', 'null'],
+            'properties': {
+                'realname': {'type': 'string'},
+                'username': {'type': 'string'},
+                },
+            },
+        },
+    }
+# Build the validator once rather than on every jsonschema.validate() call.
+PREFILL_VALIDATOR = jsonschema.Draft7Validator(PREFILL_SCHEMA)
+PREFILL_TOPLEVEL_RE = re.compile(r'^[^\s#\-.\[{]', re.MULTILINE)
+PREFILL_KEY_RE = re.compile(
+    '(?:{})[ \t]*:'.format('|'.join(map(re.escape, PREFILL_KEYS))))
+
+
+def load_prefill(stream):
+    """Parse the prefill file, looking only at its first
+    PREFILL_HEADER_SIZE characters when all of PREFILL_KEYS are found there.
+
+    In that case the rest of the file is not parsed at all, which differs
+    from a full parse in that:
+
+    * top-level sections other than PREFILL_KEYS that start after the cut
+      are missing from the result, so callers must only rely on
+      PREFILL_KEYS;
+    * a PREFILL_KEYS section repeated beyond the head is not seen, so the
+      first value wins where a full parse would keep the last one (a
+      repeat that starts inside the head triggers a full parse);
+    * errors after the cut, such as a second YAML document, are not
+      reported."""
+    head = stream.read(PREFILL_HEADER_SIZE)
+    if len(head) < PREFILL_HEADER_SIZE:
+        return yaml.load(head, Loader=SafeLoader)
+
+    # Cut at the last top-level key so that no section is truncated.
+    cut = 0
+    for m in PREFILL_TOPLEVEL_RE.finditer(head):
+        cut = m.start()
+    # A repeated PREFILL_KEYS section right after the cut would override
+    # the one in the partial parse.
+    if cut > 0 and not PREFILL_KEY_RE.match(head, cut):
+        try:
+            partial = yaml.load(head[:cut], Loader=SafeLoader)
+        except yaml.YAMLError:
+            partial = None
+        if isinstance(partial, dict) and \
+                all(k in partial for k in PREFILL_KEYS):
+            return partial
+
+    stream.seek(0)
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def read_prefill(path):
+    """Return the contents of the prefill file at path, or None if it is
+    empty, cannot be parsed or does not match PREFILL_SCHEMA."""
+    with open(path, 'r') as stream:
+        try:
+            data = load_prefill(stream)
+            if data is None:
+                return None
+            PREFILL_VALIDATOR.validate(data)
+        except (yaml.YAMLError, jsonschema.ValidationError) as exc:
+            log.error('Exception while parsing prefill file: {}.'
+                      ' Ignoring file.'.format(path))
+            log.error(exc)
+            return None
+    return data
+
 
 class SystemSetupServer(SubiquityServer):
     prefillInfo = None
@@ -70,15 +159,8 @@ class SystemSetupServer(SubiquityServer):
         if is_reconfigure(opts.dry_run):
             self.set_source_variant("wsl_configuration")
         if self.opts.prefill:
-            with open(self.opts.prefill, 'r') as stream:
-                try:
-                    # Shared with controllers thru self.app.
-                    self.prefillInfo = yaml.safe_load(stream)
-                except yaml.YAMLError as exc:
-                    log.error('Exception while parsing prefill file: {}.'
-                              ' Ignoring file.'.format(self.opts.prefill))
-                    log.error(exc)
-                    self.prefillInfo = None
+            # Shared with controllers thru self.app.
+            self.prefillInfo = read_prefill(self.opts.prefill)
 
     def make_model(self):
         root = '/'
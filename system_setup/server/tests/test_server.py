@@ -0,0 +1,156 @@
+# Copyright 2023 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+from unittest.mock import patch
+
+import yaml
+
+from subiquitycore.tests import SubiTestCase
+from system_setup.server.server import (
+    PREFILL_HEADER_SIZE,
+    load_prefill,
+    read_prefill,
+)
+
+
+PREFILL_HEAD = """\
+Welcome:
+  lang: pt_BR.UTF-8
+WSLIdentity:
+  realname: Ubuntu Preview User
+  username: ubuntu
+"""
+
+
+def padding(name, size):
+    """ Return a top-level section of roughly size characters. """
+    lines = [f'{name}:\n']
+    i = 0
+    while sum(len(line) for line in lines) < size:
+        lines.append(f'  key{i}: {"x" * 60}\n')
+        i += 1
+    return ''.join(lines)
+
+
+class TestLoadPrefill(SubiTestCase):
+    def load(self, content):
+        return load_prefill(io.StringIO(content))
+
+    def test_small_file(self):
+        content = PREFILL_HEAD + 'Extra:\n  foo: bar\n'
+        self.assertLess(len(content), PREFILL_HEADER_SIZE)
+        self.assertEqual({
+            'Welcome': {'lang': 'pt_BR.UTF-8'},
+            'WSLIdentity': {
+                'realname': 'Ubuntu Preview User',
+                'username': 'ubuntu',
+                },
+            'Extra': {'foo': 'bar'},
+            }, self.load(content))
+
+    def test_large_file_keys_in_head(self):
+        content = PREFILL_HEAD + padding('Before', 1024) + \
+            padding('After', 2 * PREFILL_HEADER_SIZE)
+        with patch('system_setup.server.server.yaml.load',
+                   wraps=yaml.load) as m_load:
+            data = self.load(content)
+        # Only the head was parsed, and it was cut before 'After'.
+        m_load.assert_called_once()
+        self.assertLessEqual(
+            len(m_load.call_args.args[0]), PREFILL_HEADER_SIZE)
+        self.assertEqual({'Welcome', 'WSLIdentity', 'Before'}, set(data))
+        self.assertEqual({'lang': 'pt_BR.UTF-8'}, data['Welcome'])
+        self.assertEqual('ubuntu', data['WSLIdentity']['username'])
+
+    def test_large_file_repeated_key_after_cut(self):
+        # The section cut at the end of the head repeats a PREFILL_KEYS
+        # section, so the whole file is parsed and the last value wins.
+        repeat = padding('Welcome', PREFILL_HEADER_SIZE).replace(
+            'Welcome:\n', 'Welcome:\n  lang: en_US.UTF-8\n')
+        content = PREFILL_HEAD + padding('Before', 1024) + repeat + \
+            padding('After', 2 * PREFILL_HEADER_SIZE)
+        data = self.load(content)
+        self.assertEqual({'Welcome', 'WSLIdentity', 'Before', 'After'},
+                         set(data))
+        self.assertEqual('en_US.UTF-8', data['Welcome']['lang'])
+
+    def test_large_file_repeated_key_after_head(self):
+        # Not seen by the partial parse: the first value wins.
+        content = PREFILL_HEAD + padding('After', 2 * PREFILL_HEADER_SIZE) + \
+            'Welcome:\n  lang: en_US.UTF-8\n'
+        self.assertEqual({'lang': 'en_US.UTF-8'},
+                         yaml.safe_load(content)['Welcome'])
+        self.assertEqual({'lang': 'pt_BR.UTF-8'},
+                         self.load(content)['Welcome'])
+
+    def test_large_file_invalid_tail(self):
+        # Not seen by the partial parse: the error is not reported.
+        content = PREFILL_HEAD + padding('After', 2 * PREFILL_HEADER_SIZE) + \
+            '---\nWelcome:\n'
+        with self.assertRaises(yaml.YAMLError):
+            yaml.safe_load(content)
+        self.assertEqual({'lang': 'pt_BR.UTF-8'},
+                         self.load(content)['Welcome'])
+
+    def test_large_file_key_after_head(self):
+        content = padding('Before', 2 * PREFILL_HEADER_SIZE) + PREFILL_HEAD
+        data = self.load(content)
+        self.assertEqual({'Before', 'Welcome', 'WSLIdentity'}, set(data))
+        self.assertEqual({'lang': 'pt_BR.UTF-8'}, data['Welcome'])
+
+    def test_cut_in_flow_collection(self):
+        # The continuation lines of the flow sequence start in column 0, so
+        # the cut lands inside it and the partial parse fails.
+        items = ''.join(f'item{i},\n' for i in range(PREFILL_HEADER_SIZE))
+        content = PREFILL_HEAD + 'Extra: [\n' + items + 'last\n]\n'
+        data = self.load(content)
+        self.assertEqual({'Welcome', 'WSLIdentity', 'Extra'}, set(data))
+        self.assertEqual(PREFILL_HEADER_SIZE + 1, len(data['Extra']))
+
+
+class TestReadPrefill(SubiTestCase):
+    def read(self, content):
+        path = self.tmp_path('prefill.yaml')
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return read_prefill(path)
+
+    def test_examples_valid(self):
+        for name in ('complete', 'missing-identity', 'missing-locale',
+                     'missing-realname', 'missing-username',
+                     'missing-welcome'):
+            path = f'examples/prefill-system-setup-{name}.yaml'
+            with self.subTest(name=name):
+                with open(path, 'r') as fp:
+                    expected = yaml.safe_load(fp)
+                self.assertEqual(expected, read_prefill(path))
+
+    def test_null_section(self):
+        self.assertEqual({'Welcome': None, 'WSLIdentity': None},
+                         self.read('Welcome:\nWSLIdentity:\n'))
+
+    def test_empty_file(self):
+        with self.assertNoLogs('system_setup.server.server'):
+            self.assertIsNone(self.read(''))
+            self.assertIsNone(self.read('# nothing to see here\n'))
+
+    def test_wrong_type(self):
+        self.assertIsNone(self.read('Welcome: pt_BR.UTF-8\n'))
+        self.assertIsNone(self.read('WSLIdentity:\n  username: [a, b]\n'))
+        self.assertIsNone(self.read('- Welcome\n'))
+
+    def test_invalid_yaml(self):
+        self.assertIsNone(self.read('Welcome: [\n'))